@@ -1,7 +1,110 @@
-import streamlit as st
+import hashlib
+import logging
+import os
+import time
 import pandas as pd
+import streamlit as st
 from datetime import datetime
-from logic import PublicationAnalyzer
+from pathlib import Path
+from logic import READER_VERSION, PublicationAnalyzer, ScopusQuotaError, read_report_csv
+
+# Pipeline progress is logged at INFO; set level=logging.DEBUG to see the diagnostics in logic.py
+logging.basicConfig(level=logging.INFO)
+
+# Rows sent to the browser for each results preview
+PREVIEW_ROWS = 500
+
+# Parsed uploads hold faculty rosters, so they live in a private app directory and are pruned after a day
+UPLOAD_CACHE_DIR = Path('.upload_cache')
+UPLOAD_CACHE_TTL = 24 * 3600
+
+
+def file_digest(uploaded_file):
+    """Content hash of an upload, so re-uploading the same file reuses cached work"""
+    return hashlib.blake2b(uploaded_file.getvalue()).hexdigest()
+
+
+def prune_upload_cache(current_prefix):
+    """Delete cached uploads that have expired or were parsed by another reader version"""
+    cutoff = time.time() - UPLOAD_CACHE_TTL
+    for path in UPLOAD_CACHE_DIR.glob('upload_*'):
+        try:
+            if not path.name.startswith(current_prefix) or path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            # Another session pruned it first
+            pass
+
+
+@st.cache_data(show_spinner=False)
+def load_report(file_hash, _uploaded_file):
+    """Parse an uploaded report once per distinct file content, keeping a Parquet copy on disk"""
+    UPLOAD_CACHE_DIR.mkdir(mode=0o700, exist_ok=True)
+    prefix = f"upload_v{READER_VERSION}_"
+    prune_upload_cache(prefix)
+    
+    parquet_path = UPLOAD_CACHE_DIR / f"{prefix}{file_hash}.parquet"
+    if parquet_path.exists():
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+    
+    df = read_report_csv(_uploaded_file)
+    # Write then rename so a concurrent session never reads a half-written file
+    partial_path = parquet_path.with_suffix('.partial')
+    df.to_parquet(partial_path, engine='pyarrow', index=False)
+    os.chmod(partial_path, 0o600)
+    partial_path.replace(parquet_path)
+    return df
+
+
+@st.cache_data(show_spinner=False, ttl=24 * 3600, max_entries=20)
+def build_report(file_1_hash, file_2_hash, start_date, end_date, df_scopus, _df1, _df2):
+    """Summarize fetched records once per pair of uploads, date range and Scopus records"""
+    # df_scopus is part of the key, so a run with failed lookups never shares a result with a complete one
+    df_faculty_summary, df_pub_summary = PublicationAnalyzer.summarize(_df1, _df2, df_scopus, start_date, end_date)
+    if df_faculty_summary is None or df_pub_summary is None:
+        return None
+    
+    # Summary metrics are computed once here so reruns just read them back
+    total_pubs = df_pub_summary['Total Publications']
+    summary_stats = {
+        'total_faculty': len(df_faculty_summary),
+        'total_pubs': total_pubs.sum(),
+        'faculty_with_pubs': (total_pubs > 0).sum(),
+        'avg_pubs': total_pubs.mean(),
+    }
+    return {
+        'df_faculty_summary': df_faculty_summary,
+        'df_pub_summary': df_pub_summary,
+        'summary_stats': summary_stats,
+    }
+
+
+def run_analysis(file_1_hash, file_2_hash, df1, df2, start_date, end_date, api_key, status_callback, force_refresh=False):
+    """Fetch Scopus records with live progress, then build the report through the cache"""
+    # The fetch stage stays uncached: it reports progress, and the disk cache already spares repeat API calls
+    analyzer = PublicationAnalyzer(api_key)
+    df1, df_scopus = analyzer.fetch_scopus_records(df1, status_callback=status_callback, force_refresh=force_refresh)
+    
+    status_callback("📋 Building the report...")
+    analysis = build_report(file_1_hash, file_2_hash, start_date, end_date, df_scopus, df1, df2)
+    if analysis is None:
+        return None
+    analysis['failed_lookups'] = len(analyzer.failed_scopus_ids)
+    return analysis
+
+
+def show_preview(df):
+    """Render at most PREVIEW_ROWS rows; the full table is available from the download buttons"""
+    st.dataframe(df.head(PREVIEW_ROWS), use_container_width=True)
+    if len(df) > PREVIEW_ROWS:
+        st.caption(f"Showing the first {PREVIEW_ROWS} of {len(df)} rows. Download the CSV for the full table.")
+
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df):
+    """Serialize a result frame for download once instead of on every rerun"""
+    return df.to_csv(index=False).encode('utf-8')
+
 
 # Configure Streamlit page
 st.set_page_config(
@@ -61,57 +164,63 @@ with col2:
     )
 
 # Main app logic
+analysis_key = None
+
 if uploaded_file_1 is not None and uploaded_file_2 is not None and scopus_api_key:
     try:
         # Load data
-        df1 = pd.read_csv(uploaded_file_1, encoding='utf-8')
-        df2 = pd.read_csv(uploaded_file_2, encoding='utf-8')
+        file_1_hash = file_digest(uploaded_file_1)
+        file_2_hash = file_digest(uploaded_file_2)
+        df1 = load_report(file_1_hash, uploaded_file_1)
+        df2 = load_report(file_2_hash, uploaded_file_2)
+        analysis_key = (file_1_hash, file_2_hash, start_date, end_date)
         
         st.success(f"✅ Files loaded successfully!")
         st.write(f"📊 Publication Report: {df1.shape[0]} rows, {df1.shape[1]} columns")
         st.write(f"👥 Author ID Report: {df2.shape[0]} rows, {df2.shape[1]} columns")
         
+        force_refresh = st.checkbox(
+            "Re-download Scopus records (ignore cache)",
+            help="Scopus records fetched in the last week are reused by default; tick this to fetch them all again"
+        )
+        
         # Process data button
         if st.button("🚀 Process Data", type="primary"):
             
             # Clear any previous results
-            for key in ['df_faculty_summary', 'df_pub_summary', 'analysis_complete']:
-                if key in st.session_state:
-                    del st.session_state[key]
+            st.session_state.pop('analysis', None)
             
             # Create status container for updates
             status_container = st.empty()
             
-            def update_status(message):
-                status_container.write(message)
-            
-            with st.spinner("Processing data... This may take several minutes."):
-                analyzer = PublicationAnalyzer(scopus_api_key)
-                
-                try:
-                    df_faculty_summary, df_pub_summary = analyzer.process_data(
-                        df1, df2, start_date, end_date, status_callback=update_status
+            try:
+                with st.spinner("Processing data... This may take several minutes."):
+                    analysis = run_analysis(
+                        file_1_hash, file_2_hash, df1, df2, start_date, end_date, scopus_api_key,
+                        status_callback=status_container.write, force_refresh=force_refresh
                     )
+                
+                if analysis is not None:
+                    # Store results in session state, tagged with the inputs they were computed from
+                    analysis['key'] = analysis_key
+                    st.session_state.analysis = analysis
+                    
+                    status_container.success("✅ Analysis completed successfully!")
+                    
+                    # Force a rerun to show results
+                    st.rerun()
                     
-                    if df_faculty_summary is not None and df_pub_summary is not None:
-                        # Store results in session state to persist downloads
-                        st.session_state.df_faculty_summary = df_faculty_summary
-                        st.session_state.df_pub_summary = df_pub_summary
-                        st.session_state.analysis_complete = True
-                        
-                        status_container.success("✅ Analysis completed successfully!")
-                        
-                        # Force a rerun to show results
-                        st.rerun()
-                        
-                    else:
-                        st.error("❌ Analysis failed. Please check your data and try again.")
-                        
-                except Exception as e:
-                    st.error(f"❌ An error occurred during processing: {str(e)}")
-                    st.write("Please check your API key and data files.")
-                    import traceback
-                    st.code(traceback.format_exc())
+                else:
+                    st.error("❌ Analysis failed. Please check your data and try again.")
+                    
+            except ScopusQuotaError as e:
+                st.error(f"❌ {e}")
+                
+            except Exception as e:
+                st.error(f"❌ An error occurred during processing: {str(e)}")
+                st.write("Please check your API key and data files.")
+                import traceback
+                st.code(traceback.format_exc())
     
     except Exception as e:
         st.error(f"❌ Error loading files: {str(e)}")
@@ -123,20 +232,28 @@ elif not scopus_api_key:
     st.info("🔑 Scopus API key not available. Please configure it in Streamlit secrets.")
 
 # Display results if analysis is complete (this will persist across reruns)
-if hasattr(st.session_state, 'analysis_complete') and st.session_state.analysis_complete:
-    df_faculty_summary = st.session_state.df_faculty_summary
-    df_pub_summary = st.session_state.df_pub_summary
+analysis = st.session_state.get('analysis')
+if analysis_key is not None and analysis is not None and analysis['key'] == analysis_key:
+    df_faculty_summary = analysis['df_faculty_summary']
+    df_pub_summary = analysis['df_pub_summary']
+    summary_stats = analysis['summary_stats']
     
     # Display results
     st.header("📊 Results")
     
+    if analysis['failed_lookups']:
+        st.warning(
+            f"⚠️ {analysis['failed_lookups']} Scopus lookups failed, so their publications are missing from these results. "
+            "Click Process Data again to retry them."
+        )
+    
     # Faculty Summary (df_8 equivalent)
     st.subheader("👥 Faculty Publication Summary")
-    st.dataframe(df_faculty_summary, use_container_width=True)
+    show_preview(df_faculty_summary)
     
     # Publication Assignment Summary (df_11 equivalent)
     st.subheader("📚 Publication Assignment Summary")
-    st.dataframe(df_pub_summary, use_container_width=True)
+    show_preview(df_pub_summary)
     
     # Download buttons - these will persist now
     st.header("⬇️ Download Results")
@@ -144,7 +261,7 @@ if hasattr(st.session_state, 'analysis_complete') and st.session_state.analysis_
     col1, col2 = st.columns(2)
     
     with col1:
-        faculty_csv = df_faculty_summary.to_csv(index=False)
+        faculty_csv = to_csv_bytes(df_faculty_summary)
         st.download_button(
             label="📋 Download Faculty Summary",
             data=faculty_csv,
@@ -154,7 +271,7 @@ if hasattr(st.session_state, 'analysis_complete') and st.session_state.analysis_
         )
     
     with col2:
-        pub_csv = df_pub_summary.to_csv(index=False)
+        pub_csv = to_csv_bytes(df_pub_summary)
         st.download_button(
             label="📊 Download Publication Summary",
             data=pub_csv,
@@ -169,26 +286,20 @@ if hasattr(st.session_state, 'analysis_complete') and st.session_state.analysis_
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_faculty = len(df_faculty_summary)
-        st.metric("Total Faculty", total_faculty)
+        st.metric("Total Faculty", summary_stats['total_faculty'])
     
     with col2:
-        total_pubs = df_pub_summary['Total Publications'].sum()
-        st.metric("Total Publications", total_pubs)
+        st.metric("Total Publications", summary_stats['total_pubs'])
     
     with col3:
-        faculty_with_pubs = (df_pub_summary['Total Publications'] > 0).sum()
-        st.metric("Faculty with Publications", faculty_with_pubs)
+        st.metric("Faculty with Publications", summary_stats['faculty_with_pubs'])
     
     with col4:
-        avg_pubs = df_pub_summary['Total Publications'].mean()
-        st.metric("Avg Publications per Faculty", f"{avg_pubs:.1f}")
+        st.metric("Avg Publications per Faculty", f"{summary_stats['avg_pubs']:.1f}")
     
     # Clear results button
     if st.button("🔄 Clear Results and Start Over", key="clear_results"):
-        for key in ['df_faculty_summary', 'df_pub_summary', 'analysis_complete']:
-            if key in st.session_state:
-                del st.session_state[key]
+        del st.session_state['analysis']
         st.rerun()
 
 # Footer
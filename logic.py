@@ -1,8 +1,256 @@
+import hashlib
+import logging
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import re
 import requests
+import sqlite3
+import streamlit as st
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Fields parsed from each Scopus abstract, in the order parse_abstract returns them
+SCOPUS_COLUMNS = [
+    "Scopus ID", "Title", "Author IDs", "Author ID List", "Publication Year",
+    "Publication Month", "Publication Day", "Document SubType", "DOI"
+]
+
+# Scopus document subtypes counted as peer-reviewed publications
+PEER_REVIEWED_TYPES = {'Article', 'Book Chapter', 'Review', 'Short Survey'}
+
+# First run of digits in a PMID-like value
+DIGITS_RE = re.compile(r'(\d+)')
+
+# Identifier columns are read as text so IDs such as ClaimedScopus are never parsed as numbers
+ID_COLUMNS = ['NetID', 'Username', 'Scopus', 'ClaimedScopus', 'MaxPR_PubMed', 'EuropePMC']
+
+# Date columns are kept as the text pandas would read, rather than pyarrow's inferred date objects
+DATE_COLUMNS = ['Arrive Date', 'Leave Date']
+
+# Bump whenever read_report_csv, ID_COLUMNS or DATE_COLUMNS change, so uploads parsed by an older reader are not reused
+READER_VERSION = 2
+
+# Raw Scopus payloads are kept on disk for a week so repeat runs only fetch new IDs
+SCOPUS_CACHE_PATH = '.scopus_cache.sqlite'
+SCOPUS_CACHE_TTL = 7 * 24 * 3600
+
+# Longest the workers wait for the API quota to reset; a later reset fails the remaining lookups instead
+MAX_QUOTA_WAIT = 60
+
+
+class ScopusQuotaError(RuntimeError):
+    """The API key's Scopus quota is spent and will not reset within MAX_QUOTA_WAIT"""
+    
+    @classmethod
+    def until(cls, timestamp):
+        reset = time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+        return cls(f"Scopus API quota exhausted until {reset}")
+
+
+def read_report_csv(file):
+    """Parse an uploaded Elements report CSV with pyarrow's multithreaded reader"""
+    # In-memory uploads are handed to Arrow as a buffer so reads skip the Python file wrapper
+    if hasattr(file, 'getbuffer'):
+        file = pa.BufferReader(pa.py_buffer(file.getbuffer()))
+    table = pacsv.read_csv(
+        file,
+        read_options=pacsv.ReadOptions(block_size=8 << 20),
+        convert_options=pacsv.ConvertOptions(
+            column_types={col: pa.string() for col in ID_COLUMNS + DATE_COLUMNS},
+            strings_can_be_null=True
+        )
+    )
+    # pyarrow reads an all-empty column as nulls (or None strings when pinned); pandas reads it as float NaN.
+    # ID columns stay text so the ID parsing downstream always sees strings
+    for i, field in enumerate(table.schema):
+        if field.name not in ID_COLUMNS and table.column(i).null_count == table.num_rows:
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    return table.to_pandas()
+
+
+def parse_pmids(values):
+    """Parse PMIDs to Int64, only falling back to regex for values that are not plain numbers"""
+    pmids = pd.to_numeric(values, errors='coerce')
+    unparsed = pmids.isna() & values.notna()
+    if unparsed.any():
+        # e.g. "PMID: 12345" or "MED/12345" - keep the first run of digits
+        digits = values[unparsed].astype(str).str.extract(DIGITS_RE, expand=False)
+        pmids[unparsed] = pd.to_numeric(digits, errors='coerce')
+    return pmids.astype('Int64')
+
+
+def as_list(value):
+    """Scopus returns a bare object for single-item arrays; always hand back a list"""
+    if isinstance(value, list):
+        return value
+    return [value] if value else []
+
+
+def dig(data, *keys):
+    """Walk a nested Scopus JSON path, returning None as soon as a level is missing"""
+    for key in keys:
+        try:
+            data = data[key]
+        except (KeyError, TypeError):
+            return None
+    return data
+
+
+def parse_abstract(sid, payload):
+    """Parse a raw Abstract Retrieval payload into a SCOPUS_COLUMNS tuple"""
+    data = orjson.loads(payload).get('abstracts-retrieval-response', {})
+    coredata = data.get('coredata') or {}
+    
+    authors = as_list(dig(data, 'authors', 'author'))
+    
+    author_ids = [a.get('@auid') for a in authors if a.get('@auid')]
+    
+    pub_date = dig(data, 'item', 'bibrecord', 'head', 'source', 'publicationdate') or {}
+    
+    return (
+        sid,
+        coredata.get("dc:title"),
+        "; ".join(author_ids),
+        tuple(author_ids),
+        pub_date.get('year'),
+        pub_date.get('month'),
+        pub_date.get('day'),
+        coredata.get("subtypeDescription"),
+        coredata.get("prism:doi"),
+    )
+
+
+def header_number(headers, name):
+    """Numeric value of a response header, or None when it is missing or malformed"""
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def status_reporter(status_callback):
+    """Return an update_status function that passes each message to status_callback and logs it"""
+    def update_status(message):
+        if status_callback:
+            status_callback(message)
+        logger.info(message)
+    return update_status
+
+
+@st.cache_resource
+def get_scopus_session(max_retries):
+    """Shared HTTP session so Scopus API connections are reused across reruns"""
+    # Transient failures and 429s are retried with exponential backoff on the pooled connection.
+    # Retry-After is ignored so a spent quota cannot stall a worker for days, and the last
+    # response is returned rather than raised so its quota headers can still be read
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry))
+    return session
+
+
+class RateLimiter:
+    """Token bucket shared by worker threads to stay under an API request rate"""
+    
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.quota_reset_at = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a request may be sent; raises ScopusQuotaError while the quota is spent"""
+        while True:
+            with self.lock:
+                if self.quota_reset_at > time.time():
+                    raise ScopusQuotaError.until(self.quota_reset_at)
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                paused = self.resume_at - time.time()
+                if paused <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(paused, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+    
+    def pause_until(self, timestamp):
+        """Hold all requests until the given epoch time, e.g. when the server quota runs low"""
+        with self.lock:
+            self.resume_at = max(self.resume_at, min(timestamp, time.time() + MAX_QUOTA_WAIT))
+    
+    def exhaust_until(self, timestamp):
+        """Fail every request until the given epoch time, when the quota is spent for longer than is worth waiting"""
+        with self.lock:
+            self.quota_reset_at = max(self.quota_reset_at, timestamp)
+
+
+@st.cache_resource
+def get_rate_limiter(key_fingerprint, rate):
+    """One limiter per API key, shared across runs and sessions since the key's quota is"""
+    return RateLimiter(rate)
+
+
+class ScopusCache:
+    """SQLite store of raw Scopus abstract payloads keyed by Scopus ID"""
+    
+    def __init__(self, path, expire_after):
+        self.path = path
+        self.expire_after = expire_after
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scopus (sid TEXT PRIMARY KEY, payload BLOB NOT NULL, fetched_at REAL NOT NULL)"
+            )
+    
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the cache safe to share between worker threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def get_many(self, sids):
+        """Return {sid: payload} for every sid with a payload that has not expired"""
+        cutoff = time.time() - self.expire_after
+        found = {}
+        with self._connect() as conn:
+            # Chunked to stay under SQLite's limit on bound parameters
+            for start in range(0, len(sids), 500):
+                chunk = sids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                found.update(conn.execute(
+                    f"SELECT sid, payload FROM scopus WHERE fetched_at >= ? AND sid IN ({placeholders})",
+                    (cutoff, *chunk)
+                ))
+        return found
+    
+    def put(self, sid, payload):
+        """Store a freshly fetched payload"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scopus (sid, payload, fetched_at) VALUES (?, ?, ?)",
+                (sid, payload, time.time())
+            )
 
 
 class PublicationAnalyzer:
@@ -12,189 +260,245 @@ class PublicationAnalyzer:
             "Accept": "application/json",
             "X-ELS-APIKey": scopus_api_key
         }
-        self.rate_limit_delay = 1.0
         self.max_retries = 3
+        # (connect, read) seconds, so a stalled socket fails its lookup instead of holding a worker
+        self.request_timeout = (5, 30)
+        self.session = get_scopus_session(self.max_retries)
+        # Scopus Abstract Retrieval allows 9 requests per second per API key
+        key_fingerprint = hashlib.sha256(scopus_api_key.encode()).hexdigest()
+        self.rate_limiter = get_rate_limiter(key_fingerprint, 9)
+        self.max_workers = 8
         self.batch_size = 25
+        self.record_cache = ScopusCache(SCOPUS_CACHE_PATH, SCOPUS_CACHE_TTL)
+        # Scopus IDs whose lookup failed on the last query, so callers can flag an incomplete report
+        self.failed_scopus_ids = []
         
     def consolidate_pmids(self, df):
         """Consolidate PMIDs from multiple columns"""
-        print(f"DEBUG: Input df shape: {df.shape}")
+        logger.debug("Input df shape: %s", df.shape)
         
-        # Clean and normalize columns - exact same as notebook
-        df['PubMed_clean'] = df['PubMed'].astype('Int64').astype('string')
-        df['MaxPR_PubMed_clean'] = df['MaxPR_PubMed'].str.extract(r'(\d+)', expand=False)
-        df['EuropePMC_clean'] = df['EuropePMC'].str.extract(r'(\d+)', expand=False)
+        # Parse each source to nullable integers, then coalesce in priority order
+        df['PubMed_clean'] = parse_pmids(df['PubMed'])
+        df['MaxPR_PubMed_clean'] = parse_pmids(df['MaxPR_PubMed'])
+        df['EuropePMC_clean'] = parse_pmids(df['EuropePMC'])
         
-        # Create final PMID column with priority - exact same as notebook
-        df['PMID Final'] = df['PubMed_clean'].combine_first(df['MaxPR_PubMed_clean']).combine_first(df['EuropePMC_clean'])
+        # The sources share df's index, so a fillna chain skips combine_first's index union
+        df['PMID Final'] = df['PubMed_clean'].fillna(df['MaxPR_PubMed_clean']).fillna(df['EuropePMC_clean'])
         
-        print(f"DEBUG: PMIDs consolidated - non-null PMID Final: {df['PMID Final'].notna().sum()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("PMIDs consolidated - non-null PMID Final: %s", df['PMID Final'].notna().sum())
         return df
     
-    def query_scopus_api(self, scopus_ids, progress_callback=None):
-        """Query Scopus API for publication metadata - simplified for debugging"""
-        print(f"DEBUG: Starting API queries for {len(scopus_ids)} Scopus IDs")
-        
-        # For debugging, let's just query the first 5 to speed things up
-        scopus_ids = scopus_ids[:5]
-        print(f"DEBUG: Limiting to first 5 IDs for debugging: {scopus_ids}")
-        
-        results = []
-        
-        for sid in scopus_ids:
-            url = f"https://api.elsevier.com/content/abstract/eid/{sid}"
+    def _download(self, sid):
+        """Request one Scopus abstract and return the raw response body"""
+        url = f"https://api.elsevier.com/content/abstract/eid/{sid}"
+        # Only cache misses reach the network, so only they take a rate limit token
+        self.rate_limiter.acquire()
+        response = self.session.get(url, headers=self.headers, timeout=self.request_timeout)
+        
+        # Pace off the quota headers: only wait for the reset when the window is nearly spent and
+        # resets soon; a spent quota that resets later fails the remaining lookups instead
+        remaining = header_number(response.headers, 'X-RateLimit-Remaining')
+        reset = header_number(response.headers, 'X-RateLimit-Reset')
+        if remaining is not None and reset is not None and remaining < 10:
+            if reset - time.time() <= MAX_QUOTA_WAIT:
+                self.rate_limiter.pause_until(reset)
+            elif remaining <= 0 or response.status_code == 429:
+                self.rate_limiter.exhaust_until(reset)
+                # The quota ran out on this very request, so it is a quota failure rather than one to retry
+                if response.status_code != 200:
+                    raise ScopusQuotaError.until(reset)
+        
+        # Raise rather than return so failed lookups are not cached
+        if response.status_code != 200:
+            raise requests.HTTPError(f"API failed with status {response.status_code}", response=response)
+        
+        return response.content
+    
+    def _fetch_one(self, sid):
+        """Download a record missing from the disk cache and store it, returned as a SCOPUS_COLUMNS tuple"""
+        payload = self._download(sid)
+        # Parsed before storing so only readable payloads reach the disk cache
+        record = parse_abstract(sid, payload)
+        self.record_cache.put(sid, payload)
+        return record
+    
+    def query_scopus_api(self, scopus_ids, progress_callback=None, force_refresh=False):
+        """Query Scopus API for publication metadata; force_refresh re-downloads records already on disk"""
+        logger.debug("Starting API queries for %s Scopus IDs", len(scopus_ids))
+        
+        # Build the frame column-wise rather than from a list of per-record dicts
+        results = {column: [] for column in SCOPUS_COLUMNS}
+        
+        # Records fetched on earlier runs come back from one bulk cache read; only the rest go to the network
+        cached = {} if force_refresh else self.record_cache.get_many(scopus_ids)
+        missing = [sid for sid in scopus_ids if sid not in cached]
+        logger.debug("%s Scopus IDs served from the disk cache, %s to fetch", len(cached), len(missing))
+        
+        for sid, payload in cached.items():
+            for column, value in zip(SCOPUS_COLUMNS, parse_abstract(sid, payload)):
+                results[column].append(value)
+        
+        if progress_callback and cached:
+            progress_callback(len(cached), len(scopus_ids))
+        
+        quota_error = None
+        quota_failures = 0
+        self.failed_scopus_ids = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._fetch_one, sid): sid for sid in missing}
             
-            try:
-                response = requests.get(url, headers=self.headers)
-                
-                if response.status_code == 200:
-                    data = response.json().get('abstracts-retrieval-response', {})
-                    coredata = data.get('coredata', {})
-                    
-                    authors = data.get('authors', {}).get('author', [])
-                    if isinstance(authors, dict):
-                        authors = [authors]
-                    
-                    author_ids = [a.get('@auid') for a in authors if a.get('@auid')]
-                    
-                    pub_date = (data.get('item', {})
-                               .get('bibrecord', {})
-                               .get('head', {})
-                               .get('source', {})
-                               .get('publicationdate', {}))
-                    
-                    year = pub_date.get('year')
-                    month = pub_date.get('month')
-                    day = pub_date.get('day')
-                    
-                    result = {
-                        "Scopus ID": sid,
-                        "Title": coredata.get("dc:title"),
-                        "Author IDs": "; ".join(author_ids),
-                        "Publication Year": year,
-                        "Publication Month": month,
-                        "Publication Day": day,
-                        "Document SubType": coredata.get("subtypeDescription"),
-                        "DOI": coredata.get("prism:doi"),
-                    }
-                    
-                    results.append(result)
+            # Handle lookups as they finish so one slow request does not stall progress
+            for done, future in enumerate(as_completed(futures), start=len(cached) + 1):
+                sid = futures[future]
+                try:
+                    record = future.result()
+                    for column, value in zip(SCOPUS_COLUMNS, record):
+                        results[column].append(value)
                     
-                    print(f"DEBUG: API result for {sid}:")
-                    print(f"  Title: {result['Title']}")
-                    print(f"  Author IDs: {result['Author IDs']}")
-                    print(f"  Document SubType: {result['Document SubType']}")
-                    print(f"  Year: {result['Publication Year']}")
+                    logger.debug("API result for %s:", sid)
+                    logger.debug("  Title: %s", results['Title'][-1])
+                    logger.debug("  Author IDs: %s", results['Author IDs'][-1])
+                    logger.debug("  Document SubType: %s", results['Document SubType'][-1])
+                    logger.debug("  Year: %s", results['Publication Year'][-1])
                     
-                else:
-                    print(f"DEBUG: API failed for {sid}: {response.status_code}")
-                    
-            except Exception as e:
-                print(f"DEBUG: API error for {sid}: {str(e)}")
-            
-            time.sleep(self.rate_limit_delay)
-        
-        print(f"DEBUG: API queries complete - got {len(results)} results")
-        return pd.DataFrame(results)
+                except ScopusQuotaError as e:
+                    quota_error = e
+                    quota_failures += 1
+                except Exception as e:
+                    logger.warning("API error for %s: %s", sid, e)
+                    self.failed_scopus_ids.append(sid)
+                
+                if progress_callback:
+                    progress_callback(done, len(scopus_ids))
+        
+        if quota_error is not None:
+            # Records fetched before the quota ran out are already on disk, so a later run resumes from there
+            raise ScopusQuotaError(
+                f"{quota_error}; {quota_failures} of {len(scopus_ids)} Scopus IDs could not be looked up. "
+                "Records fetched so far are cached, so re-run after the reset to finish the report."
+            )
+        
+        logger.debug("API queries complete - got %s results", len(results['Scopus ID']))
+        # Rows follow scopus_ids rather than cache or completion order, so the same records always give the same frame
+        order = {sid: i for i, sid in enumerate(scopus_ids)}
+        return pd.DataFrame(results).sort_values('Scopus ID', key=lambda ids: ids.map(order), ignore_index=True)
     
-    def combine_date_parts(self, year, month, day):
-        """Safely combine date parts into datetime"""
-        try:
-            month = '01' if not month or pd.isna(month) else str(month).zfill(2)
-            day = '01' if not day or pd.isna(day) else str(day).zfill(2)
-            return datetime.strptime(f"{month}/{day}/{year}", "%m/%d/%Y").date()
-        except:
-            return pd.NaT
+    def process_data(self, df1, df2, start_date, end_date, status_callback=None, force_refresh=False):
+        """Build the AAAEM faculty summary from both reports; returns (faculty summary, publication summary placeholder)"""
+        df1, df_scopus = self.fetch_scopus_records(df1, status_callback=status_callback, force_refresh=force_refresh)
+        return self.summarize(df1, df2, df_scopus, start_date, end_date, status_callback=status_callback)
     
-    def process_data(self, df1, df2, start_date, end_date, status_callback=None):
-        """Simplified processing pipeline for debugging"""
-        
-        def update_status(message):
-            if status_callback:
-                status_callback(message)
-            print(message)
+    def fetch_scopus_records(self, df1, status_callback=None, force_refresh=False):
+        """Steps 1-2: consolidate PMIDs and look up every Scopus ID in df1; returns (df1, Scopus records)"""
+        update_status = status_reporter(status_callback)
         
         # Step 1: Consolidate PMIDs
         update_status("🔄 Step 1: Consolidating PMIDs...")
         df1 = self.consolidate_pmids(df1)
         
-        # Step 2: Get unique Scopus IDs and query API (limited for debugging)
-        unique_scopus_ids = df1['Scopus'].dropna().astype(str).unique().tolist()
+        # Step 2: Get unique Scopus IDs and query API
+        # Normalized in place so stray whitespace neither duplicates an API call nor misses the join
+        scopus = df1['Scopus'].astype('string').str.strip()
+        df1['Scopus'] = scopus.mask(scopus.eq(''))
+        unique_scopus_ids = df1['Scopus'].dropna().unique().tolist()
         update_status(f"🔍 Step 2: Found {len(unique_scopus_ids)} unique Scopus IDs")
         
         if not unique_scopus_ids:
             raise ValueError("No Scopus IDs found in the data!")
         
-        df_scopus = self.query_scopus_api(unique_scopus_ids)
+        df_scopus = self.query_scopus_api(
+            unique_scopus_ids,
+            progress_callback=lambda done, total: update_status(f"🔍 Step 2: Queried {done} of {total} Scopus IDs"),
+            force_refresh=force_refresh
+        )
+        return df1, df_scopus
+    
+    @staticmethod
+    def summarize(df1, df2, df_scopus, start_date, end_date, status_callback=None):
+        """Steps 3-7, which make no API calls: returns (faculty summary, publication summary placeholder)"""
+        update_status = status_reporter(status_callback)
+        
+        # Diagnostics below scan whole frames, so they only run when debug logging is on
+        debug = logger.isEnabledFor(logging.DEBUG)
         
         # Step 3: Add publication dates
         update_status("📅 Step 3: Processing publication dates...")
-        df_scopus['Publication Date'] = df_scopus.apply(
-            lambda row: self.combine_date_parts(
-                row['Publication Year'], 
-                row['Publication Month'], 
-                row['Publication Day']
-            ), axis=1
-        )
+        # Typed as datetime64 once here, on unique Scopus records rather than merged rows
+        # Date parts are converted as numbers and assembled in one call; a missing or blank month/day defaults to 1
+        date_parts = pd.DataFrame({
+            'year': pd.to_numeric(df_scopus['Publication Year'], errors='coerce'),
+            'month': pd.to_numeric(df_scopus['Publication Month'], errors='coerce').fillna(1),
+            'day': pd.to_numeric(df_scopus['Publication Day'], errors='coerce').fillna(1),
+        })
+        df_scopus['Publication Date'] = pd.to_datetime(date_parts, errors='coerce')
         
-        print(f"DEBUG: Scopus data after dates:")
-        print(df_scopus[['Scopus ID', 'Title', 'Author IDs', 'Document SubType', 'Publication Date']].head())
+        # A handful of subtypes repeat on every merged row, so they are carried as category codes;
+        # stripped first so padded values still match PEER_REVIEWED_TYPES
+        df_scopus['Document SubType'] = df_scopus['Document SubType'].str.strip().astype('category')
         
-        # Step 4: Merge datasets
-        update_status("🔗 Step 4: Merging datasets...")
-        print(f"DEBUG: Before merging:")
-        print(f"  df1 shape: {df1.shape}")
-        print(f"  df2 shape: {df2.shape}")
-        print(f"  df_scopus shape: {df_scopus.shape}")
-        print(f"  df1 NetID unique: {df1['NetID'].nunique()}")
-        print(f"  df2 Username unique: {df2['Username'].nunique()}")
+        if debug:
+            logger.debug("Scopus data after dates:\n%s", df_scopus[['Scopus ID', 'Title', 'Author IDs', 'Document SubType', 'Publication Date']].head())
         
-        # First merge: df2 + df1
-        df_merged = df2.merge(df1, left_on='Username', right_on='NetID', how='left')
-        print(f"DEBUG: After first merge (df2 + df1): {df_merged.shape}")
-        print(f"DEBUG: Non-null Scopus in merged: {df_merged['Scopus'].notna().sum()}")
+        # Step 4: Filter by date range and peer-review status
+        update_status("📊 Step 4: Filtering by date and peer-review...")
+        # Both filters depend only on the Scopus record, so they run on unique records before the merge
+        # rather than on every faculty/publication row
+        start_date_ts = pd.Timestamp(start_date)
+        end_date_ts = pd.Timestamp(end_date)
         
-        # Second merge: add Scopus data
-        df_merged = df_merged.merge(df_scopus, left_on='Scopus', right_on='Scopus ID', how='left')
-        print(f"DEBUG: After second merge (+ Scopus): {df_merged.shape}")
-        print(f"DEBUG: Non-null Scopus ID in final: {df_merged['Scopus ID'].notna().sum()}")
+        date_mask = df_scopus['Publication Date'].between(start_date_ts, end_date_ts)
+        peer_reviewed_mask = df_scopus['Document SubType'].isin(PEER_REVIEWED_TYPES)
+        df_scopus_in_range = df_scopus[date_mask & peer_reviewed_mask]
+        
+        if debug:
+            logger.debug("Date filtering from %s to %s", start_date_ts, end_date_ts)
+            logger.debug("Records with valid dates: %s", df_scopus['Publication Date'].notna().sum())
+            logger.debug("Records in date range: %s", date_mask.sum())
+            logger.debug("Peer-reviewed records: %s", peer_reviewed_mask.sum())
+            logger.debug("Records passing both filters: %s", len(df_scopus_in_range))
+            logger.debug("Document subtypes found: %s", df_scopus['Document SubType'].value_counts())
+        
+        # Step 5: Merge datasets
+        update_status("🔗 Step 5: Merging datasets...")
+        if debug:
+            logger.debug("Before merging:")
+            logger.debug("  df1 shape: %s", df1.shape)
+            logger.debug("  df2 shape: %s", df2.shape)
+            logger.debug("  df_scopus shape: %s", df_scopus_in_range.shape)
+            logger.debug("  df1 NetID unique: %s", df1['NetID'].nunique())
+            logger.debug("  df2 Username unique: %s", df2['Username'].nunique())
+        
+        # Index the lookup frames on their keys so each join probes the index directly
+        df1_by_netid = df1.set_index('NetID')
+        df_scopus_by_id = df_scopus_in_range.set_index('Scopus ID', drop=False)
+        
+        # First join: df2 + df1; every faculty member is kept here for the summary, with or without publications
+        df_faculty = df2.join(df1_by_netid, on='Username', how='left', lsuffix='_x', rsuffix='_y')
+        if debug:
+            logger.debug("After first merge (df2 + df1): %s", df_faculty.shape)
+            logger.debug("Non-null Scopus in merged: %s", df_faculty['Scopus'].notna().sum())
+        
+        # Second join: only rows whose Scopus record passed the filters
+        # Each Scopus ID maps to at most one record, so validate that instead of silently fanning out rows
+        df_merged = df_faculty.join(df_scopus_by_id, on='Scopus', how='inner', validate='many_to_one').reset_index(drop=True)
+        if debug:
+            logger.debug("After second merge (+ Scopus): %s", df_merged.shape)
         
         # Show sample of merged data
-        sample_merged = df_merged[df_merged['Scopus ID'].notna()].head(3)
-        if len(sample_merged) > 0:
-            print(f"DEBUG: Sample merged data:")
-            for idx, row in sample_merged.iterrows():
-                print(f"  Username: {row['Username']}")
-                print(f"  ClaimedScopus: {row['ClaimedScopus']}")
-                print(f"  Author IDs: {row['Author IDs']}")
-                print(f"  Document SubType: {row['Document SubType']}")
-                print(f"  ---")
-        
-        # Step 5: Flag author positions - EXACT same as notebook
-        update_status("👥 Step 5: Flagging author positions...")
-        
-        def flag_author_position(claimed_ids, paper_author_ids):
-            if pd.isna(claimed_ids) or pd.isna(paper_author_ids):
-                return pd.Series([False, False, False])
-            
-            claimed_set = set(claimed_ids.split(';'))
-            paper_list = [a.strip() for a in paper_author_ids.split(';') if a.strip()]
-            
-            print(f"    DEBUG: Comparing claimed_set={claimed_set} vs paper_list={paper_list}")
-            
-            if len(paper_list) == 1:
-                only_author = paper_list[0]
-                first = only_author in claimed_set
-                print(f"    DEBUG: Single author match: {first}")
-                return pd.Series([first, False, False])
-            
-            first = paper_list[0] in claimed_set
-            last = paper_list[-1] in claimed_set
-            middle = any(a in claimed_set for a in paper_list[1:-1])
-            
-            print(f"    DEBUG: Multi-author matches: first={first}, last={last}, middle={middle}")
-            
-            return pd.Series([first, last, middle])
+        if debug:
+            sample_merged = df_merged.head(3)
+            if len(sample_merged) > 0:
+                logger.debug("Sample merged data:")
+                for idx, row in sample_merged.iterrows():
+                    logger.debug("  Username: %s", row['Username'])
+                    logger.debug("  ClaimedScopus: %s", row['ClaimedScopus'])
+                    logger.debug("  Author IDs: %s", row['Author IDs'])
+                    logger.debug("  Document SubType: %s", row['Document SubType'])
+                    logger.debug("  ---")
+        
+        # Step 6: Flag author positions - EXACT same as notebook
+        update_status("👥 Step 6: Flagging author positions...")
         
         # Define a mask for rows that appear to be valid publications
         valid_pub_mask = (
@@ -203,131 +507,105 @@ class PublicationAnalyzer:
             df_merged['Title'].notna()
         )
         
-        print(f"DEBUG: Valid publication mask: {valid_pub_mask.sum()} out of {len(df_merged)}")
+        if debug:
+            logger.debug("Valid publication mask: %s out of %s", valid_pub_mask.sum(), len(df_merged))
         
         # Initialize all flags to False
         df_merged['Is_First_Author'] = False
         df_merged['Is_Last_Author'] = False
         df_merged['Is_Middle_Author'] = False
         
-        # Apply author position flagging - manually for debugging
-        valid_rows = df_merged[valid_pub_mask]
-        print(f"DEBUG: Processing {len(valid_rows)} valid rows for author flagging...")
+        # Author lists were parsed once per Scopus record; only the claimed IDs need splitting
+        valid_rows = df_merged.loc[valid_pub_mask, ['ClaimedScopus', 'Author ID List']]
+        if debug:
+            logger.debug("Processing %s valid rows for author flagging...", len(valid_rows))
         
-        for idx, row in valid_rows.head(10).iterrows():  # Just first 10 for debugging
-            print(f"  DEBUG: Processing row {idx}, Username: {row['Username']}")
-            
-            result = flag_author_position(str(row['ClaimedScopus']), str(row['Author IDs']))
-            df_merged.at[idx, 'Is_First_Author'] = result.iloc[0]
-            df_merged.at[idx, 'Is_Last_Author'] = result.iloc[1]
-            df_merged.at[idx, 'Is_Middle_Author'] = result.iloc[2]
-        
-        print(f"DEBUG: After author flagging:")
-        print(f"  First author flags: {df_merged['Is_First_Author'].sum()}")
-        print(f"  Last author flags: {df_merged['Is_Last_Author'].sum()}")
-        print(f"  Middle author flags: {df_merged['Is_Middle_Author'].sum()}")
-        
-        # Step 6: Flag peer-reviewed publications
-        update_status("📖 Step 6: Flagging peer-reviewed publications...")
-        
-        def flag_peer_reviewed(doc_subtype):
-            peer_reviewed_types = {'Article', 'Book Chapter', 'Review', 'Short Survey'}
-            if pd.isna(doc_subtype):
-                return False
-            return doc_subtype.strip() in peer_reviewed_types
-        
-        df_merged['Is Peer-Reviewed'] = df_merged['Document SubType'].apply(flag_peer_reviewed)
-        
-        print(f"DEBUG: Peer-reviewed publications: {df_merged['Is Peer-Reviewed'].sum()}")
-        print(f"DEBUG: Document subtypes found: {df_merged['Document SubType'].value_counts()}")
-        
-        # Step 7: Filter by date range and peer-review status
-        update_status("📊 Step 7: Filtering by date and peer-review...")
-        
-        # Convert the column to proper booleans
-        df_merged['Is Peer-Reviewed'] = df_merged['Is Peer-Reviewed'].astype(str).str.upper().eq("TRUE")
-        
-        # Ensure proper datetime type
-        df_merged['Publication Date'] = pd.to_datetime(df_merged['Publication Date'], errors='coerce')
-        
-        start_date_ts = pd.Timestamp(start_date)
-        end_date_ts = pd.Timestamp(end_date)
-        
-        print(f"DEBUG: Date filtering from {start_date_ts} to {end_date_ts}")
-        print(f"DEBUG: Publications with valid dates: {df_merged['Publication Date'].notna().sum()}")
-        
-        date_mask = (
-            (df_merged['Publication Date'] >= start_date_ts) &
-            (df_merged['Publication Date'] <= end_date_ts)
+        # A faculty member's claimed IDs repeat on every one of their rows, so each distinct string is split once
+        claimed = valid_rows['ClaimedScopus'].fillna('')
+        claimed_lookup = {
+            ids: frozenset(a.strip() for a in ids.split(';') if a.strip())
+            for ids in claimed.unique()
+        }
+        claimed_sets = claimed.map(claimed_lookup)
+        pairs = [
+            (paper if isinstance(paper, tuple) else (), claimed)
+            for paper, claimed in zip(valid_rows['Author ID List'], claimed_sets)
+        ]
+        
+        # A sole author is only ever flagged as first author
+        first = [bool(paper) and paper[0] in claimed for paper, claimed in pairs]
+        last = [len(paper) > 1 and paper[-1] in claimed for paper, claimed in pairs]
+        middle = [any(a in claimed for a in paper[1:-1]) for paper, claimed in pairs]
+        
+        df_merged.loc[valid_pub_mask, ['Is_First_Author', 'Is_Last_Author', 'Is_Middle_Author']] = (
+            np.column_stack([first, last, middle]).astype(bool)
         )
-        print(f"DEBUG: Publications in date range: {date_mask.sum()}")
-        
-        peer_reviewed_mask = df_merged['Is Peer-Reviewed']
-        print(f"DEBUG: Peer-reviewed publications: {peer_reviewed_mask.sum()}")
-        
-        combined_mask = peer_reviewed_mask & date_mask
-        print(f"DEBUG: Publications passing both filters: {combined_mask.sum()}")
-        
-        df_filtered = df_merged[combined_mask].copy()
         
-        print(f"DEBUG: Final filtered dataset: {df_filtered.shape}")
-        
-        # Fix boolean-like flag columns before proceeding
-        for col in ['Is_First_Author', 'Is_Last_Author', 'Is_Middle_Author', 'Is Peer-Reviewed']:
-            df_filtered[col] = df_filtered[col].astype(str).str.upper().eq("TRUE")
-        
-        print(f"DEBUG: Final authorship flags in filtered data:")
-        print(f"  First author: {df_filtered['Is_First_Author'].sum()}")
-        print(f"  Last author: {df_filtered['Is_Last_Author'].sum()}")
-        print(f"  Middle author: {df_filtered['Is_Middle_Author'].sum()}")
+        if debug:
+            logger.debug("After author flagging:")
+            logger.debug("  First author flags: %s", df_merged['Is_First_Author'].sum())
+            logger.debug("  Last author flags: %s", df_merged['Is_Last_Author'].sum())
+            logger.debug("  Middle author flags: %s", df_merged['Is_Middle_Author'].sum())
+        
+        # Only the columns the summaries read are carried forward
+        df_filtered = df_merged[[
+            'Username', 'Scopus ID', 'Title', 'DOI', 'PMID Final', 'Publication Date',
+            'Is_First_Author', 'Is_Last_Author', 'Is_Middle_Author'
+        ]]
+        
+        if debug:
+            logger.debug("Final filtered dataset: %s", df_filtered.shape)
+            logger.debug("Final authorship flags in filtered data:")
+            logger.debug("  First author: %s", df_filtered['Is_First_Author'].sum())
+            logger.debug("  Last author: %s", df_filtered['Is_Last_Author'].sum())
+            logger.debug("  Middle author: %s", df_filtered['Is_Middle_Author'].sum())
         
         # Show what we have in filtered data
-        if len(df_filtered) > 0:
-            print(f"DEBUG: Sample of filtered data:")
+        if debug and len(df_filtered) > 0:
             sample = df_filtered[['Username', 'Title', 'Is_First_Author', 'Is_Last_Author', 'Is_Middle_Author']].head(3)
-            print(sample.to_string())
+            logger.debug("Sample of filtered data:\n%s", sample.to_string())
         
-        # Step 8: Generate simplified faculty summary
-        update_status("📋 Step 8: Generating faculty summary...")
+        # Step 7: Generate simplified faculty summary
+        update_status("📋 Step 7: Generating faculty summary...")
         
         # Get faculty list
-        faculty_info = df_merged[['Computed Name Abbreviated', 'Username', 'Position_x', 'Arrive Date', 'Leave Date']].drop_duplicates()
-        print(f"DEBUG: Faculty count: {len(faculty_info)}")
-        
-        # Simple any-position summary for debugging
-        summary_rows = []
-        for _, row in faculty_info.iterrows():
-            netid = row['Username']
-            person_summary = row.to_dict()
-            
-            # Check what publications this person has in filtered data
-            person_pubs = df_filtered[df_filtered['Username'] == netid]
-            
-            any_position_count = len(person_pubs)
-            any_position_pmids = person_pubs['PMID Final'].dropna().astype(str).tolist()
-            
-            person_summary.update({
-                'Any_Position_PMIDs': ', '.join(any_position_pmids),
-                'Any_Position_PMID_Count': any_position_count,
-                'Any_Position_NonPMID_Count': 0,
-                'Is_First_Author_PMIDs': '',
-                'Is_First_Author_PMID_Count': 0,
-                'Is_First_Author_NonPMID_Count': 0,
-                'Is_Last_Author_PMIDs': '',
-                'Is_Last_Author_PMID_Count': 0,
-                'Is_Last_Author_NonPMID_Count': 0,
-                'Is_Middle_Author_PMIDs': '',
-                'Is_Middle_Author_PMID_Count': 0,
-                'Is_Middle_Author_NonPMID_Count': 0,
-                'Coauthor with Another Faculty': 'No'
-            })
-            
-            if any_position_count > 0:
-                print(f"DEBUG: {netid} has {any_position_count} publications")
-            
-            summary_rows.append(person_summary)
-        
-        df_faculty_summary = pd.DataFrame(summary_rows)
+        faculty_info = df_faculty[['Computed Name Abbreviated', 'Username', 'Position_x', 'Arrive Date', 'Leave Date']].drop_duplicates()
+        if debug:
+            logger.debug("Faculty count: %s", len(faculty_info))
+        
+        # One indicator column per authorship position, so every PMID list and count
+        # comes out of a single groupby instead of re-scanning df_filtered per faculty.
+        # For each position, the PMID list and PMID count cover that person's filtered publications
+        # in that position that have a PMID, and the non-PMID count covers the ones without
+        has_pmid = df_filtered['PMID Final'].notna()
+        pmid_text = df_filtered['PMID Final'].astype('string')
+        position_masks = {
+            'Any_Position': pd.Series(True, index=df_filtered.index),
+            'Is_First_Author': df_filtered['Is_First_Author'],
+            'Is_Last_Author': df_filtered['Is_Last_Author'],
+            'Is_Middle_Author': df_filtered['Is_Middle_Author'],
+        }
+        position_columns = {'Username': df_filtered['Username']}
+        aggregations = {}
+        pmid_list_columns = []
+        count_columns = []
+        for prefix, mask in position_masks.items():
+            position_columns[f'{prefix}_PMIDs'] = pmid_text.where(mask & has_pmid)
+            position_columns[f'{prefix}_PMID_Count'] = mask & has_pmid
+            position_columns[f'{prefix}_NonPMID_Count'] = mask & ~has_pmid
+            aggregations[f'{prefix}_PMIDs'] = (f'{prefix}_PMIDs', lambda s: ', '.join(s.dropna()))
+            aggregations[f'{prefix}_PMID_Count'] = (f'{prefix}_PMID_Count', 'sum')
+            aggregations[f'{prefix}_NonPMID_Count'] = (f'{prefix}_NonPMID_Count', 'sum')
+            pmid_list_columns.append(f'{prefix}_PMIDs')
+            count_columns += [f'{prefix}_PMID_Count', f'{prefix}_NonPMID_Count']
+        
+        per_faculty = pd.DataFrame(position_columns).groupby('Username', sort=False).agg(**aggregations)
+        
+        df_faculty_summary = faculty_info.merge(per_faculty, left_on='Username', right_index=True, how='left')
+        df_faculty_summary[pmid_list_columns] = df_faculty_summary[pmid_list_columns].fillna('')
+        df_faculty_summary[count_columns] = df_faculty_summary[count_columns].fillna(0).astype(int)
+        df_faculty_summary['Coauthor with Another Faculty'] = 'No'
+        df_faculty_summary = df_faculty_summary.reset_index(drop=True)
         
         # Rename columns to AAAEM template
         column_renames = {
@@ -348,7 +626,8 @@ class PublicationAnalyzer:
         
         df_faculty_summary = df_faculty_summary.rename(columns=column_renames)
         
-        print(f"DEBUG: Faculty with any position publications: {(df_faculty_summary['Number of PubMed indexed publications during the past AY (authorship in any position)'] > 0).sum()}")
+        if debug:
+            logger.debug("Faculty with any position publications: %s", (df_faculty_summary['Number of PubMed indexed publications during the past AY (authorship in any position)'] > 0).sum())
         
         # Simple publication summary
         df_pub_summary = pd.DataFrame({
@@ -358,6 +637,6 @@ class PublicationAnalyzer:
             'Total Publications': [0]
         })
         
-        update_status("✅ Debug processing completed!")
+        update_status("✅ Processing completed!")
         
         return df_faculty_summary, df_pub_summary
\ No newline at end of file
@@ -0,0 +1,81 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import orjson
+
+import logic
+
+
+def abstract_payload(sid):
+    """Smallest Abstract Retrieval body parse_abstract accepts"""
+    return orjson.dumps({'abstracts-retrieval-response': {'coredata': {'dc:title': f'Title {sid}'}}})
+
+
+class FakeResponse:
+    def __init__(self, status_code, remaining, reset, content=b''):
+        self.status_code = status_code
+        self.headers = {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)}
+        self.content = content
+
+
+class FakeSession:
+    """Answers each request from a list of responses, repeating the last one"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return response
+
+
+class QuotaExhaustionTest(unittest.TestCase):
+    SIDS = [f'2-s2.0-{n}' for n in range(5)]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.reset = time.time() + 3 * 24 * 3600
+        # A private cache and limiter, so records and quota state never leak between tests
+        with mock.patch.object(logic, 'SCOPUS_CACHE_PATH', str(Path(self.tmp.name) / 'cache.sqlite')):
+            self.analyzer = logic.PublicationAnalyzer('test-key')
+        self.analyzer.rate_limiter = logic.RateLimiter(1000)
+        self.analyzer.max_workers = 1
+
+    def test_exhausting_response_counts_as_quota_failure(self):
+        self.analyzer.session = FakeSession([FakeResponse(429, 0, self.reset)])
+
+        with self.assertRaisesRegex(logic.ScopusQuotaError, r'5 of 5 Scopus IDs could not be looked up'):
+            self.analyzer.query_scopus_api(self.SIDS)
+
+        # Only the first request reaches the network; none of them is offered for a retry
+        self.assertEqual(self.analyzer.session.calls, 1)
+        self.assertEqual(self.analyzer.failed_scopus_ids, [])
+
+    def test_payload_that_spends_the_quota_is_kept(self):
+        self.analyzer.session = FakeSession([
+            FakeResponse(200, 0, self.reset, abstract_payload(self.SIDS[0])),
+            FakeResponse(429, 0, self.reset),
+        ])
+
+        with self.assertRaisesRegex(logic.ScopusQuotaError, r'4 of 5 Scopus IDs could not be looked up'):
+            self.analyzer.query_scopus_api(self.SIDS)
+
+        self.assertEqual(self.analyzer.session.calls, 1)
+        self.assertEqual(list(self.analyzer.record_cache.get_many(self.SIDS)), [self.SIDS[0]])
+
+    def test_malformed_quota_headers_keep_the_payload(self):
+        self.analyzer.session = FakeSession([FakeResponse(200, 'junk', 'junk', abstract_payload(self.SIDS[0]))])
+
+        df = self.analyzer.query_scopus_api(self.SIDS[:1])
+
+        self.assertEqual(df['Scopus ID'].tolist(), self.SIDS[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()